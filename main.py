@@ -1,12 +1,15 @@
-import boto3
+import asyncio
+import codecs
+import io
 import json
 import time
-import random
 import uuid
-import string
 import logging
-import pprint
+import queue
 import sys
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError, NoCredentialsError
 
 
@@ -20,13 +23,54 @@ logger = logging.getLogger(__name__)
 # Define constant for region
 REGION_NAME = 'us-east-1'
 
+# Connection pool sized for concurrent async invocations, with keep-alive so
+# connections (and their TLS sessions) are reused across turns
+CLIENT_CONFIG_OPTIONS = {
+    "max_pool_connections": 50,
+    "tcp_keepalive": True,
+    "connect_timeout": 3,
+    "read_timeout": 120,
+    "retries": {"max_attempts": 5, "mode": "standard"}
+}
+
+# Streamed output is flushed every N chunks or after this many seconds, whichever comes first
+FLUSH_EVERY_CHUNKS = 8
+FLUSH_INTERVAL_SECONDS = 0.05
+
+# Size of the stdout buffer used by the REPL when output is piped
+STDOUT_BUFFER_SIZE = 65536
+
+# User label sent in the REPL's session attributes
+SESSION_USER = "local"
+
+# Number of typed-ahead inputs the REPL holds while a turn is still streaming
+MAX_QUEUED_TURNS = 4
+
+# Upper bound on agent invocations in flight at once from the async API
+MAX_CONCURRENT_INVOCATIONS = 8
+_invoke_semaphores = weakref.WeakKeyDictionary()
+
+# Worker threads for the blocking boto3 calls behind the async API
+_executor = ThreadPoolExecutor(max_workers=16)
+_STREAM_END = object()
+
+# Shared bedrock-agent-runtime client, created on first use by get_client()
+_client = None
+_client_lock = threading.Lock()
+
 
 def create_client():
     """Create and return a bedrock-agent-runtime client with error handling."""
+    # boto3 is imported here rather than at module level so importing this
+    # module (e.g. from the tests) does not pay for loading the SDK
+    import boto3
+    from botocore.client import Config
+
     try:
-        print("Creating Bedrock client...")
-        client = boto3.client(service_name='bedrock-agent-runtime', region_name=REGION_NAME)
-        print("Client created:", client)
+        logger.debug("Creating Bedrock client")
+        session = boto3.session.Session()
+        client = session.client(service_name='bedrock-agent-runtime', region_name=REGION_NAME, config=Config(**CLIENT_CONFIG_OPTIONS))
+        logger.debug("Client created: %s", client)
         return client
     except NoCredentialsError:
         logger.error("No AWS credentials found. Please configure your AWS credentials.")
@@ -36,15 +80,95 @@ def create_client():
         sys.exit(1)
 
 
-# Initialize the client globally 
-try:
-    bedrock_agent_runtime = create_client()
-except Exception as e:
-    logger.critical(f"Fatal error initializing Bedrock client: {str(e)}")
-    sys.exit(1)
+def get_client():
+    """Return the shared bedrock-agent-runtime client, creating it on first use."""
+    global _client
+    # Double-checked so concurrent first calls from worker threads create only one client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                try:
+                    _client = create_client()
+                except Exception as e:
+                    logger.critical(f"Fatal error initializing Bedrock client: {str(e)}")
+                    sys.exit(1)
+    return _client
+
+
+def _build_invoke_params(inputText, sessionId, agentAliasId, agentId, enable_trace, memoryId, session_state, endSession, latency=None):
+    """Build the invoke_agent request parameters."""
+    invoke_params = {
+        "agentAliasId": agentAliasId,   
+        "agentId": agentId,       
+        "sessionId": sessionId,       
+        "inputText": inputText,
+        "endSession": endSession,  
+        "enableTrace": enable_trace
+    }
+    
+    # Add optional memoryId and session state if provided; an empty session
+    # state is left out rather than allocated and serialised on every turn
+    if memoryId:
+        invoke_params["memoryId"] = memoryId
+    if session_state:
+        invoke_params["sessionState"] = session_state
+
+    # Request a latency profile for the underlying model if one was given
+    if latency:
+        invoke_params["bedrockModelConfigurations"] = {"performanceConfig": {"latency": latency}}
+    return invoke_params
+
+
+def _log_client_error(ce):
+    """Log a Bedrock ClientError and return its error code."""
+    error_code = ce.response.get('Error', {}).get('Code', 'Unknown')
+    error_message = ce.response.get('Error', {}).get('Message', 'Unknown error')
+    
+    if error_code == 'ThrottlingException':
+        logger.warning(f"API throttling detected. Waiting before retry: {error_message}")
+    elif error_code == 'ValidationException':
+        logger.error(f"Validation error: {error_message}")
+    elif error_code == 'AccessDeniedException':
+        logger.error(f"Access denied: {error_message}. Check your IAM permissions.")
+    elif error_code == 'ResourceNotFoundException':
+        logger.error(f"Resource not found: {error_message}. Check your agent IDs.")
+    else:
+        logger.error(f"AWS API error: {error_code} - {error_message}")
+    
+    return error_code
+
+
+def _handle_chunk(event, out, enable_trace):
+    """Write a chunk event's bytes to out, returning True if anything was written."""
+    chunk = event['chunk']
+    if 'bytes' in chunk:
+        out.write(chunk['bytes'])
+        return True
+    logger.warning("Received chunk without 'bytes' field")
+    return False
+
+
+def _handle_trace(event, out, enable_trace):
+    """Log a trace event if tracing is enabled."""
+    if enable_trace and logger.isEnabledFor(logging.INFO):
+        logger.info("Trace event: %s", json.dumps(event['trace'], separators=(',', ':'), default=str))
+    return False
+
+
+def _handle_unknown(event, out, enable_trace):
+    """Warn about an event type we don't handle."""
+    logger.warning(f"Unexpected event type: {event}")
+    return False
 
 
-def invoke(inputText, sessionId, agentAliasId, agentId, enable_trace=False, memoryId=None, session_state=None, endSession=False):
+# Each event-stream item is a dict with a single key naming its event type
+_HANDLERS = {
+    'chunk': _handle_chunk,
+    'trace': _handle_trace
+}
+
+
+def invoke(inputText, sessionId, agentAliasId, agentId, enable_trace=False, memoryId=None, session_state=None, endSession=False, out=None, latency=None, cancel=None):
     """
     Invoke the Bedrock agent with comprehensive error handling.
     
@@ -57,13 +181,14 @@ def invoke(inputText, sessionId, agentAliasId, agentId, enable_trace=False, memo
         memoryId (str): Optional memory ID
         session_state (dict): Optional session state
         endSession (bool): Whether to end the session
+        out (BinaryIO): Optional binary stream for the response, defaults to stdout
+        latency (str): Optional model latency profile, 'standard' or 'optimized'
+            (optimized is only available for some models and regions)
+        cancel (threading.Event): Optional event that stops reading the response when set
     
     Returns:
         bool: True if successful, False if failed
     """
-    if not session_state:
-        session_state = {}
-    
     # Validate inputs
     if not all([inputText, sessionId, agentAliasId, agentId]):
         logger.error("Required parameters missing: inputText, sessionId, agentAliasId, and agentId must be provided")
@@ -71,27 +196,15 @@ def invoke(inputText, sessionId, agentAliasId, agentId, enable_trace=False, memo
         
     try:
         # Create request parameters
-        invoke_params = {
-            "agentAliasId": agentAliasId,   
-            "agentId": agentId,       
-            "sessionId": sessionId,       
-            "inputText": inputText,
-            "endSession": endSession,  
-            "enableTrace": enable_trace, 
-            "sessionState": session_state
-        }
-        
-        # Add optional memoryId if provided
-        if memoryId:
-            invoke_params["memoryId"] = memoryId
+        invoke_params = _build_invoke_params(inputText, sessionId, agentAliasId, agentId, enable_trace, memoryId, session_state, endSession, latency)
             
         # Make the API call
-        response = bedrock_agent_runtime.invoke_agent(**invoke_params)
+        response = get_client().invoke_agent(**invoke_params)
         
-        # Log trace information if enabled
-        if enable_trace:
-            logger.info("Trace information:")
-            logger.info(pprint.pformat(response))
+        # Log trace information if enabled. Only the metadata is logged: the
+        # completion is a lazy event stream that formatting could consume.
+        if enable_trace and logger.isEnabledFor(logging.INFO):
+            logger.info("ResponseMetadata: %s", response.get('ResponseMetadata', {}))
         
         # Process the response stream
         event_stream = response.get("completion")
@@ -99,43 +212,40 @@ def invoke(inputText, sessionId, agentAliasId, agentId, enable_trace=False, memo
             logger.error("No completion stream returned from Bedrock")
             return False
             
+        # Write the raw UTF-8 bytes straight to stdout, prefixing once per turn
+        # and flushing in batches rather than after every chunk. Output that
+        # nobody is watching live is only flushed at the end of the turn.
+        if out is None:
+            sys.stdout.flush()
+            out = sys.stdout.buffer
+        live = out.isatty()
+        out.write(b"JARVIS: ")
+        n = 0
+        last_flush = time.monotonic()
+
         # Process events in the stream
         for event in event_stream:
-            if 'chunk' in event:
-                chunk = event.get('chunk', {})
-                if 'bytes' in chunk:
-                    try:
-                        text = chunk['bytes'].decode('utf-8')
-                        print(f"JARVIS: {text}", end="", flush=True)
-                    except UnicodeDecodeError as ude:
-                        logger.error(f"Failed to decode response bytes: {ude}")
-                else:
-                    logger.warning("Received chunk without 'bytes' field")
-            elif 'trace' in event:
-                if enable_trace:
-                    logger.info(f"Trace event: {json.dumps(event['trace'], indent=2)}")
-            else:
-                logger.warning(f"Unexpected event type: {event}")
-        
-        print()  # Add newline after all chunks
+            if cancel is not None and cancel.is_set():
+                # Stop reading; closing the stream releases its connection
+                if hasattr(event_stream, 'close'):
+                    event_stream.close()
+                break
+
+            # Handlers return True when they wrote a chunk to out
+            if _HANDLERS.get(next(iter(event), None), _handle_unknown)(event, out, enable_trace) and live:
+                n += 1
+                now = time.monotonic()
+                if n % FLUSH_EVERY_CHUNKS == 0 or now - last_flush > FLUSH_INTERVAL_SECONDS:
+                    out.flush()
+                    last_flush = now
+
+        out.write(b"\n")  # Add newline after all chunks
+        out.flush()
         return True
         
     except ClientError as ce:
-        error_code = ce.response.get('Error', {}).get('Code', 'Unknown')
-        error_message = ce.response.get('Error', {}).get('Message', 'Unknown error')
-        
-        if error_code == 'ThrottlingException':
-            logger.warning(f"API throttling detected. Waiting before retry: {error_message}")
+        if _log_client_error(ce) == 'ThrottlingException':
             time.sleep(2)  # Wait before potential retry
-        elif error_code == 'ValidationException':
-            logger.error(f"Validation error: {error_message}")
-        elif error_code == 'AccessDeniedException':
-            logger.error(f"Access denied: {error_message}. Check your IAM permissions.")
-        elif error_code == 'ResourceNotFoundException':
-            logger.error(f"Resource not found: {error_message}. Check your agent IDs.")
-        else:
-            logger.error(f"AWS API error: {error_code} - {error_message}")
-        
         return False
 
     except Exception as e:
@@ -143,6 +253,107 @@ def invoke(inputText, sessionId, agentAliasId, agentId, enable_trace=False, memo
         return False
 
 
+async def stream_async(inputText, sessionId, agentAliasId, agentId, enable_trace=False, memoryId=None, session_state=None, endSession=False, latency=None):
+    """
+    Invoke the agent from asyncio code and yield the response text as it streams in.
+
+    The synchronous boto3 call and the blocking event stream both run on a shared
+    thread pool; decoded chunks are handed back through an asyncio.Queue so many
+    invocations can overlap their network latency on one event loop. Concurrent
+    invocations are bounded by a shared semaphore.
+
+    Yields:
+        str: Decoded response text as it arrives
+
+    Raises:
+        ValueError: If required parameters are missing
+        ClientError: If the Bedrock API call fails
+    """
+    if not all([inputText, sessionId, agentAliasId, agentId]):
+        raise ValueError("inputText, sessionId, agentAliasId, and agentId must be provided")
+
+    invoke_params = _build_invoke_params(inputText, sessionId, agentAliasId, agentId, enable_trace, memoryId, session_state, endSession, latency)
+    loop = asyncio.get_running_loop()
+
+    async with _get_invoke_semaphore():
+        response = await loop.run_in_executor(_executor, lambda: get_client().invoke_agent(**invoke_params))
+        event_stream = response.get("completion")
+        if not event_stream:
+            raise RuntimeError("No completion stream returned from Bedrock")
+
+        queue = asyncio.Queue()
+        reader = loop.run_in_executor(_executor, _drain_stream, event_stream, queue, loop, enable_trace)
+        while True:
+            text = await queue.get()
+            if text is _STREAM_END:
+                break
+            yield text
+        await reader  # Re-raise any error hit while reading the stream
+
+
+def _drain_stream(event_stream, queue, loop, enable_trace):
+    """Read a blocking event stream on a worker thread, handing decoded chunks to the event loop."""
+    out = _QueueWriter(queue, loop)
+    try:
+        for event in event_stream:
+            _HANDLERS.get(next(iter(event), None), _handle_unknown)(event, out, enable_trace)
+        out.close()
+    finally:
+        loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+
+
+class _QueueWriter:
+    """Minimal binary writer that decodes chunks and hands them to an asyncio.Queue from another thread."""
+
+    def __init__(self, queue, loop):
+        self.queue = queue
+        self.loop = loop
+        # Chunk boundaries can fall inside a multi-byte character, so decode incrementally
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def write(self, data):
+        text = self.decoder.decode(data, final=False)
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+
+    def close(self):
+        text = self.decoder.decode(b'', final=True)
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+
+
+async def invoke_async(inputText, sessionId, agentAliasId, agentId, **kwargs):
+    """
+    Invoke the agent from asyncio code and return the full response text.
+
+    Batch callers can gather many of these (one session each) to overlap their
+    network latency. Keyword arguments are passed through to stream_async().
+
+    Returns:
+        str: The agent response, or None if the invocation failed
+    """
+    try:
+        return "".join([text async for text in stream_async(inputText, sessionId, agentAliasId, agentId, **kwargs)])
+    except ClientError as ce:
+        if _log_client_error(ce) == 'ThrottlingException':
+            await asyncio.sleep(2)  # Wait before potential retry
+        return None
+    except Exception as e:
+        logger.error(f"Unexpected error during async agent invocation: {str(e)}")
+        return None
+
+
+def _get_invoke_semaphore():
+    """Return the semaphore bounding concurrent invocations on the running event loop."""
+    # An asyncio.Semaphore binds to the loop it is first contended on, so keep
+    # one per loop; each asyncio.run() by a batch caller gets a fresh one
+    loop = asyncio.get_running_loop()
+    semaphore = _invoke_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _invoke_semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT_INVOCATIONS)
+    return semaphore
+
+
 def end_session(agentAliasId, sessionId, agentId, memoryId=None):
     """End the agent session with error handling."""
     try:
@@ -156,6 +367,74 @@ def end_session(agentAliasId, sessionId, agentId, memoryId=None):
         logger.error(f"Error ending session: {str(e)}")
 
 
+def _run_turns(turns, agentAliasId, sessionId, agentId, memoryId=None, cancel=None):
+    """Worker loop that sends queued user inputs to the agent in order until it receives None or cancel is set."""
+    # Session attributes carried across turns so the agent sees a consistent session
+    session_state = {"sessionAttributes": {"user": SESSION_USER, "turn": "0"}}
+    turn = 0
+    try:
+        while True:
+            user_input = turns.get()
+            if user_input is None or (cancel is not None and cancel.is_set()):
+                break
+
+            turn += 1
+            session_state["sessionAttributes"]["turn"] = str(turn)
+            success = invoke(user_input, sessionId, agentAliasId, agentId, memoryId=memoryId, session_state=session_state, cancel=cancel)
+            if cancel is not None and cancel.is_set():
+                break
+            if not success:
+                print("JARVIS: I'm sorry, I'm having trouble processing your request right now. Please try again later.")
+
+            # Only prompt again if the user hasn't already typed ahead
+            if turns.empty():
+                print("You: ", end="")
+            sys.stdout.flush()  # End of turn
+            turns.task_done()
+    except BaseException as e:
+        # Includes SystemExit, which would otherwise end this thread silently
+        logger.error(f"Chat worker stopped unexpectedly: {e!r}")
+
+
+def _turn_in_flight(turns):
+    """Return True while a queued turn hasn't been answered; the worker prompts once it is."""
+    # put() counts each turn and the worker's task_done() marks it answered
+    return turns.unfinished_tasks > 0
+
+
+def _put_turn(turns, worker, item):
+    """Queue an item for the worker, returning False instead of blocking if the worker has stopped."""
+    while worker.is_alive():
+        try:
+            turns.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _stop_turns(turns, worker):
+    """Let the worker finish any queued turns, then wait for it to exit."""
+    if _put_turn(turns, worker, None):
+        worker.join()
+
+
+def _cancel_turns(turns, worker, cancel):
+    """Stop the answer being streamed, discard any queued turns and wait for the worker to exit."""
+    cancel.set()
+    while True:
+        try:
+            turns.get_nowait()
+        except queue.Empty:
+            break
+    try:
+        if _put_turn(turns, worker, None):
+            worker.join()
+    except KeyboardInterrupt:
+        # A second Ctrl-C means don't wait; the worker is a daemon thread
+        logger.warning("Stopped waiting for the current answer to finish")
+
+
 def chat_with_agent(agentAliasId, sessionId, agentId, memoryId=None, max_retries=3):
     """
     Main function to chat with the agent with retry logic.
@@ -167,41 +446,89 @@ def chat_with_agent(agentAliasId, sessionId, agentId, memoryId=None, max_retries
         memoryId (str): Optional memory ID
         max_retries (int): Maximum number of retries on transient errors
     """
+    # Create the client up front so a failure exits here rather than inside the worker thread
+    get_client()
+
+    # When output is piped rather than shown in a terminal, buffer it in one
+    # large block and write it out once per turn instead of per chunk
+    original_stdout = sys.stdout
+    if not sys.stdout.isatty():
+        sys.stdout = io.TextIOWrapper(
+            io.BufferedWriter(sys.stdout.buffer, buffer_size=STDOUT_BUFFER_SIZE),
+            encoding=sys.stdout.encoding,
+            errors=sys.stdout.errors,
+            line_buffering=False,
+            write_through=False
+        )
+
     print("This is JARVIS, your personal assistant. Type 'exit' to end the conversation.")
+
+    # Turns are sent to the agent by a worker thread so the user can type the
+    # next question while the previous answer is still streaming
+    turns = queue.Queue(maxsize=MAX_QUEUED_TURNS)
+    cancel = threading.Event()
+    worker = threading.Thread(target=_run_turns, args=(turns, agentAliasId, sessionId, agentId, memoryId, cancel), daemon=True)
+    worker.start()
+    prompt = "You: "
     
     try:
         while True:
             try:
-                user_input = input("You: ")
+                user_input = input(prompt)
                 
                 if not user_input.strip():
-                    print("Please enter some text. Type 'exit' to end the conversation.")
+                    # While an answer is streaming the worker owns the prompt, so
+                    # a blank line is ignored rather than printed over the answer
+                    if _turn_in_flight(turns):
+                        prompt = ""
+                    else:
+                        print("Please enter some text. Type 'exit' to end the conversation.")
+                        prompt = "You: "
                     continue
                     
                 if user_input.lower() in ["exit", "quit", "bye"]:
+                    _stop_turns(turns, worker)
                     print("Ending session...")
                     end_session(agentAliasId, sessionId, agentId, memoryId)
                     break
                                 
-                success = invoke(user_input, sessionId, agentAliasId, agentId, memoryId=memoryId)                
-                if not success:
-                    print("JARVIS: I'm sorry, I'm having trouble processing your request right now. Please try again later.")
+                if not _put_turn(turns, worker, user_input):
+                    print("\nJARVIS stopped unexpectedly. Please check the logs for details.")
+                    break
+                prompt = ""  # The worker re-prompts once the answer is done
                     
             except KeyboardInterrupt:
                 confirm = input("\nDo you want to exit? (y/n): ")
                 if confirm.lower() in ['y', 'yes']:
+                    _cancel_turns(turns, worker, cancel)
                     print("Ending session...")
                     end_session(agentAliasId, sessionId, agentId, memoryId)
                     break
+                prompt = "" if _turn_in_flight(turns) else "You: "
+
+            except EOFError:
+                # End of input (a piped script running out, or Ctrl-D) ends the chat like 'exit'
+                _stop_turns(turns, worker)
+                print("Ending session...")
+                end_session(agentAliasId, sessionId, agentId, memoryId)
+                break
             
     except Exception as e:
         logger.error(f"Fatal error in chat session: {str(e)}")
         print("\nAn unexpected error occurred. Please check the logs for details.")
         # Try to end the session gracefully
         try:
+            _stop_turns(turns, worker)
             end_session(agentAliasId, sessionId, agentId, memoryId)
         except:
             pass
+
+    finally:
+        if sys.stdout is not original_stdout:
+            # Detach both wrapper layers so discarding them doesn't close the real stdout
+            sys.stdout.flush()
+            sys.stdout.detach().detach()
+            sys.stdout = original_stdout
         
 
 if __name__ == '__main__':
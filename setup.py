@@ -1,61 +1,163 @@
-import boto3
 import json
-import time, random 
-import uuid, string
+import string
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError, WaiterError
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def create_policy(iam_client, account_id, policy_name, policy_document):
-    """Create an IAM policy with error handling"""
+# IAM policy documents, serialised once as compact JSON with ${...} placeholders
+# for the values only known at runtime
+BEDROCK_POLICY_TEMPLATE = string.Template(json.dumps({
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Sid": "AmazonBedrockAgentBedrockFoundationModelPolicyProd",
+            "Effect": "Allow",
+            "Action": [
+                "bedrock:InvokeModel",
+                "bedrock:InvokeModelWithResponseStream"
+            ],
+            "Resource": [
+                "arn:aws:bedrock:${region}::foundation-model/${model}"
+            ]
+        }
+    ]
+}, separators=(',', ':')))
+
+ASSUME_ROLE_POLICY_TEMPLATE = string.Template(json.dumps({
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Sid": "AmazonBedrockAgentBedrockFoundationModelPolicyProd",
+            "Effect": "Allow",
+            "Principal": {
+                "Service": "bedrock.amazonaws.com"
+            },
+            "Action": "sts:AssumeRole",
+            "Condition": {
+                "StringEquals": {
+                    "aws:SourceAccount": "${account_id}"
+                },
+                "ArnLike": {
+                    "aws:SourceArn": "arn:aws:bedrock:${region}:${account_id}:agent/*"
+                }
+            }
+        }
+    ]
+}, separators=(',', ':')))
+
+# Attempts at create_agent while a new IAM role propagates to Bedrock
+ROLE_PROPAGATION_RETRIES = 5
+
+# Page size for the list_* existence checks, which stop at the first match
+LIST_PAGE_SIZE = 50
+
+# Largest page IAM returns, used for listings that have to be read in full
+IAM_MAX_PAGE_SIZE = 1000
+
+def wait_for_status(get_status, ready_statuses, description, max_attempts=20, max_delay=8):
+    """Poll get_status with exponential backoff until it reports a ready (or failed) status"""
+    status = None
+    for attempt in range(max_attempts):
+        status = get_status()
+        if status in ready_statuses or status == 'FAILED':
+            return status
+        logger.info(f"{description} is {status}, checking again shortly...")
+        time.sleep(min(2 ** attempt, max_delay))
+    logger.warning(f"Timed out waiting for {description}; last status: {status}")
+    return status
+
+def list_existing(iam_client, operation, result_key, name_key, **kwargs):
+    """Map names to resources for everything a paginated IAM list_* operation returns
+
+    Returns None if the caller isn't allowed to list, so callers fall back to
+    checking each resource individually.
+    """
+    paginator = iam_client.get_paginator(operation)
+    try:
+        return {
+            item[name_key]: item
+            for page in paginator.paginate(PaginationConfig={'PageSize': IAM_MAX_PAGE_SIZE}, **kwargs)
+            for item in page[result_key]
+        }
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'AccessDenied':
+            logger.info(f"Not permitted to call {operation}, checking resources individually")
+            return None
+        raise
+
+def get_or_none(get_operation, result_key, **kwargs):
+    """Call an IAM get_* operation, returning None instead of raising if the resource doesn't exist"""
+    try:
+        return get_operation(**kwargs)[result_key]
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchEntity':
+            return None
+        raise
+
+def create_policy(iam_client, account_id, policy_name, policy_document, existing_policies=None):
+    """Create an IAM policy with error handling
+
+    existing_policies optionally maps policy names to policies (see list_existing)
+    and replaces the get_policy existence probe.
+    """
     try:
         # Check if policy already exists to avoid duplicates
-        try:
-            existing_policy = iam_client.get_policy(PolicyArn=f"arn:aws:iam::{account_id}:policy/{policy_name}")
+        if existing_policies is not None:
+            existing_policy = existing_policies.get(policy_name)
+        else:
+            existing_policy = get_or_none(iam_client.get_policy, 'Policy', PolicyArn=f"arn:aws:iam::{account_id}:policy/{policy_name}")
+        if existing_policy:
             logger.info(f"Policy {policy_name} already exists, using existing policy")
-            return {"Policy": {"Arn": existing_policy['Policy']['Arn']}}
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchEntity':
-                # Policy doesn't exist, create it
-                logger.info(f"Creating policy: {policy_name}")
-                policy = iam_client.create_policy(
-                    PolicyName=policy_name,
-                    PolicyDocument=policy_document
-                )
-                logger.info(f"Successfully created policy: {policy_name}")
-                return policy
-            else:
-                raise
+            return {"Policy": {"Arn": existing_policy['Arn']}}
+
+        # Policy doesn't exist, create it
+        logger.info(f"Creating policy: {policy_name}")
+        policy = iam_client.create_policy(
+            PolicyName=policy_name,
+            PolicyDocument=policy_document
+        )
+        logger.info(f"Successfully created policy: {policy_name}")
+        return policy
     except ClientError as e:
         logger.error(f"Failed to create policy {policy_name}: {e}")
         raise
 
-def create_role(iam_client, role_name, assume_role_policy_document):
-    """Create an IAM role with error handling"""
+def create_role(iam_client, role_name, assume_role_policy_document, existing_roles=None):
+    """Create an IAM role with error handling
+
+    existing_roles optionally maps role names to roles (see list_existing)
+    and replaces the get_role existence probe. The result's "Created" flag
+    says whether the role was created by this call.
+    """
     try:
         # Check if role already exists
-        try:
-            existing_role = iam_client.get_role(RoleName=role_name)
+        if existing_roles is not None:
+            existing_role = existing_roles.get(role_name)
+        else:
+            existing_role = get_or_none(iam_client.get_role, 'Role', RoleName=role_name)
+        if existing_role:
             logger.info(f"Role {role_name} already exists, using existing role")
-            return {"Role": existing_role['Role']}
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchEntity':
-                # Role doesn't exist, create it
-                logger.info(f"Creating role: {role_name}")
-                role = iam_client.create_role(
-                    RoleName=role_name,
-                    AssumeRolePolicyDocument=assume_role_policy_document
-                )
-                logger.info(f"Successfully created role: {role_name}")
-                # Wait for IAM role to propagate
-                logger.info(f"Waiting for role {role_name} to propagate...")
-                time.sleep(10)
-                return role
-            else:
-                raise
+            return {"Role": existing_role, "Created": False}
+
+        # Role doesn't exist, create it
+        logger.info(f"Creating role: {role_name}")
+        role = iam_client.create_role(
+            RoleName=role_name,
+            AssumeRolePolicyDocument=assume_role_policy_document
+        )
+        logger.info(f"Successfully created role: {role_name}")
+        # Wait for IAM role to become visible
+        logger.info(f"Waiting for role {role_name} to propagate...")
+        try:
+            iam_client.get_waiter('role_exists').wait(RoleName=role_name)
+        except WaiterError as we:
+            logger.warning(f"Role {role_name} not yet visible: {we}")
+        return {"Role": role['Role'], "Created": True}
     except ClientError as e:
         logger.error(f"Failed to create role {role_name}: {e}")
         raise
@@ -64,11 +166,12 @@ def attach_policy_to_role(iam_client, role_name, policy_arn):
     """Attach a policy to a role with error handling"""
     try:
         # Check if policy is already attached
-        attached_policies = iam_client.list_attached_role_policies(RoleName=role_name)
-        for policy in attached_policies['AttachedPolicies']:
-            if policy['PolicyArn'] == policy_arn:
-                logger.info(f"Policy {policy_arn} is already attached to role {role_name}")
-                return
+        paginator = iam_client.get_paginator('list_attached_role_policies')
+        for page in paginator.paginate(RoleName=role_name, PaginationConfig={'PageSize': LIST_PAGE_SIZE}):
+            for policy in page['AttachedPolicies']:
+                if policy['PolicyArn'] == policy_arn:
+                    logger.info(f"Policy {policy_arn} is already attached to role {role_name}")
+                    return
         
         # Attach the policy
         logger.info(f"Attaching policy {policy_arn} to role {role_name}")
@@ -81,39 +184,68 @@ def attach_policy_to_role(iam_client, role_name, policy_arn):
         logger.error(f"Failed to attach policy to role {role_name}: {e}")
         raise
 
-def create_agent(bedrock_agent_client, agent_name, role_arn, description, instruction, foundation_model):
-    """Create a Bedrock agent with error handling"""
+def create_agent(bedrock_agent_client, agent_name, role_arn, description, instruction, foundation_model, role_created=False):
+    """Create a Bedrock agent with error handling
+
+    Set role_created when the role was created in this run, so validation
+    failures caused by it still propagating are retried.
+    """
     try:
         # Check if agent already exists
         try:
-            agents = bedrock_agent_client.list_agents()
-            for agent in agents.get('agentSummaries', []):
-                if agent['agentName'] == agent_name:
-                    logger.info(f"Agent {agent_name} already exists, using existing agent")
-                    return {"agent": {"agentId": agent['agentId']}}
+            paginator = bedrock_agent_client.get_paginator('list_agents')
+            for page in paginator.paginate(PaginationConfig={'PageSize': LIST_PAGE_SIZE}):
+                for agent in page.get('agentSummaries', []):
+                    if agent['agentName'] == agent_name:
+                        logger.info(f"Agent {agent_name} already exists, using existing agent")
+                        return {"agent": {"agentId": agent['agentId']}}
         except ClientError as e:
             if e.response['Error']['Code'] != 'ResourceNotFoundException':
                 raise
         
         # Create new agent
         logger.info(f"Creating agent: {agent_name}")
-        response = bedrock_agent_client.create_agent(
-            agentName=agent_name,
-            agentResourceRoleArn=role_arn,
-            description=description,
-            idleSessionTTLInSeconds=1800,
-            foundationModel=foundation_model,
-            instruction=instruction,
-            memoryConfiguration={
-                "enabledMemoryTypes": ["SESSION_SUMMARY"],
-                "storageDays": 30
-            }
-        )
+        # A freshly created role can take a few seconds before Bedrock accepts it,
+        # so retry validation failures with backoff instead of sleeping up front.
+        # An existing role isn't propagating, so its errors are raised straight away.
+        attempts = ROLE_PROPAGATION_RETRIES if role_created else 1
+        for attempt in range(attempts):
+            try:
+                response = bedrock_agent_client.create_agent(
+                    agentName=agent_name,
+                    agentResourceRoleArn=role_arn,
+                    description=description,
+                    idleSessionTTLInSeconds=1800,
+                    foundationModel=foundation_model,
+                    instruction=instruction,
+                    memoryConfiguration={
+                        "enabledMemoryTypes": ["SESSION_SUMMARY"],
+                        "storageDays": 30
+                    }
+                )
+                break
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ValidationException' or attempt == attempts - 1:
+                    raise
+                logger.info(f"Agent role not accepted yet, retrying: {e}")
+                time.sleep(min(2 ** attempt, 8))
         logger.info(f"Successfully created agent: {agent_name}")
         
         # Wait for agent creation to complete
         logger.info(f"Waiting for agent {agent_name} to be ready...")
-        time.sleep(30)
+        agent_id = response['agent']['agentId']
+        status = wait_for_status(
+            lambda: bedrock_agent_client.get_agent(agentId=agent_id)['agent']['agentStatus'],
+            {'NOT_PREPARED', 'PREPARED'},
+            f"Agent {agent_name}"
+        )
+        
+        if status == 'FAILED':
+            raise RuntimeError(f"Agent {agent_name} failed to create")
+        elif status not in ('NOT_PREPARED', 'PREPARED'):
+            logger.warning(f"Agent creation status: {status}. This may not be ready yet.")
+        else:
+            logger.info(f"Agent {agent_name} is ready with status: {status}")
         return response
     except ClientError as e:
         logger.error(f"Failed to create agent {agent_name}: {e}")
@@ -127,13 +259,15 @@ def prepare_agent(bedrock_agent_client, agent_id):
         
         # Wait for agent preparation to complete
         logger.info(f"Waiting for agent {agent_id} to finish preparation...")
-        time.sleep(30)
-        
-        # Check agent status
-        agent_status = bedrock_agent_client.get_agent(agentId=agent_id)
-        status = agent_status.get('agent', {}).get('status')
+        status = wait_for_status(
+            lambda: bedrock_agent_client.get_agent(agentId=agent_id).get('agent', {}).get('agentStatus'),
+            {'PREPARED'},
+            f"Agent {agent_id}"
+        )
         
-        if status != 'PREPARED':
+        if status == 'FAILED':
+            raise RuntimeError(f"Agent {agent_id} failed to prepare")
+        elif status != 'PREPARED':
             logger.warning(f"Agent preparation status: {status}. This may not be 'PREPARED' yet.")
         else:
             logger.info(f"Agent successfully prepared with status: {status}")
@@ -147,11 +281,12 @@ def create_agent_alias(bedrock_agent_client, agent_id, alias_name):
     try:
         # Check if alias already exists
         try:
-            aliases = bedrock_agent_client.list_agent_aliases(agentId=agent_id)
-            for alias in aliases.get('agentAliasSummaries', []):
-                if alias['agentAliasName'] == alias_name:
-                    logger.info(f"Alias {alias_name} already exists, using existing alias")
-                    return {"agentAlias": {"agentAliasId": alias['agentAliasId']}}
+            paginator = bedrock_agent_client.get_paginator('list_agent_aliases')
+            for page in paginator.paginate(agentId=agent_id, PaginationConfig={'PageSize': LIST_PAGE_SIZE}):
+                for alias in page.get('agentAliasSummaries', []):
+                    if alias['agentAliasName'] == alias_name:
+                        logger.info(f"Alias {alias_name} already exists, using existing alias")
+                        return {"agentAlias": {"agentAliasId": alias['agentAliasId']}}
         except ClientError as e:
             if e.response['Error']['Code'] != 'ResourceNotFoundException':
                 raise
@@ -166,20 +301,36 @@ def create_agent_alias(bedrock_agent_client, agent_id, alias_name):
         
         # Wait for alias creation to complete
         logger.info(f"Waiting for agent alias {alias_name} to be ready...")
-        time.sleep(10)
+        alias_id = response['agentAlias']['agentAliasId']
+        status = wait_for_status(
+            lambda: bedrock_agent_client.get_agent_alias(agentId=agent_id, agentAliasId=alias_id)['agentAlias']['agentAliasStatus'],
+            {'PREPARED'},
+            f"Agent alias {alias_name}"
+        )
+        
+        if status == 'FAILED':
+            raise RuntimeError(f"Agent alias {alias_name} failed to create")
+        elif status != 'PREPARED':
+            logger.warning(f"Agent alias status: {status}. This may not be 'PREPARED' yet.")
+        else:
+            logger.info(f"Agent alias successfully prepared with status: {status}")
         return response
     except ClientError as e:
         logger.error(f"Failed to create agent alias {alias_name}: {e}")
         raise
 
+def create_clients():
+    """Create the boto3 session and the IAM, STS and Bedrock agent clients used by setup"""
+    # Imported lazily so importing this module does not pay for loading the SDK
+    import boto3
+
+    session = boto3.session.Session()
+    return session, session.client('iam'), session.client('sts'), session.client('bedrock-agent')
+
 def main():
     try:
         # Initialize AWS clients
-        iam = boto3.client('iam')
-        sts_client = boto3.client('sts')
-        bedrock_agent_client = boto3.client('bedrock-agent')
-
-        session = boto3.session.Session()
+        session, iam, sts_client, bedrock_agent_client = create_clients()
         region_name = session.region_name
         try:
             account_id = sts_client.get_caller_identity()["Account"]
@@ -209,51 +360,24 @@ def main():
         agent_alias_name = 'test'
 
         # Create IAM policy
-        bedrock_agent_bedrock_allow_policy_statement = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Sid": "AmazonBedrockAgentBedrockFoundationModelPolicyProd",
-                    "Effect": "Allow",
-                    "Action": [
-                        "bedrock:InvokeModel",
-                        "bedrock:InvokeModelWithResponseStream"
-                    ],
-                    "Resource": [
-                        f"arn:aws:bedrock:{region_name}::foundation-model/{foundationModel}"
-                    ]
-                }
-            ]
-        }
-        bedrock_policy_json = json.dumps(bedrock_agent_bedrock_allow_policy_statement)
+        bedrock_policy_json = BEDROCK_POLICY_TEMPLATE.substitute(region=region_name, model=foundationModel)
         
         # Create IAM Role assume policy
-        assume_role_policy_document = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Sid": "AmazonBedrockAgentBedrockFoundationModelPolicyProd",
-                    "Effect": "Allow",
-                    "Principal": {
-                        "Service": "bedrock.amazonaws.com"
-                    },
-                    "Action": "sts:AssumeRole",
-                    "Condition": {
-                        "StringEquals": {
-                            "aws:SourceAccount": account_id
-                        },
-                        "ArnLike": {
-                            "aws:SourceArn": f"arn:aws:bedrock:{region_name}:{account_id}:agent/*"
-                        }
-                    }
-                }
-            ]
-        }
-        assume_role_policy_document_json = json.dumps(assume_role_policy_document)
+        assume_role_policy_document_json = ASSUME_ROLE_POLICY_TEMPLATE.substitute(region=region_name, account_id=account_id)
 
         # Execute the setup workflow with error handling
-        agent_bedrock_policy = create_policy(iam, account_id, agent_bedrock_allow_policy_name, bedrock_policy_json)
-        agent_role = create_role(iam, agent_role_name, assume_role_policy_document_json)
+        # The policy and role don't depend on each other, so look up what already
+        # exists with one listing each, then create them in parallel
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future_policies = executor.submit(list_existing, iam, 'list_policies', 'Policies', 'PolicyName', Scope='Local')
+            future_roles = executor.submit(list_existing, iam, 'list_roles', 'Roles', 'RoleName')
+            existing_policies = future_policies.result()
+            existing_roles = future_roles.result()
+
+            future_policy = executor.submit(create_policy, iam, account_id, agent_bedrock_allow_policy_name, bedrock_policy_json, existing_policies)
+            future_role = executor.submit(create_role, iam, agent_role_name, assume_role_policy_document_json, existing_roles)
+            agent_bedrock_policy = future_policy.result()
+            agent_role = future_role.result()
         attach_policy_to_role(iam, agent_role_name, agent_bedrock_policy['Policy']['Arn'])
         
         agent_response = create_agent(
@@ -262,7 +386,8 @@ def main():
             agent_role['Role']['Arn'],
             description,
             instruction,
-            foundationModel
+            foundationModel,
+            role_created=agent_role['Created']
         )
         
         agent_id = agent_response['agent']['agentId']
@@ -1,28 +1,169 @@
-from unittest.mock import patch
-from main import invoke, end_session 
+import asyncio
+import io
+import queue
+import threading
+import time
+from unittest.mock import MagicMock, patch
+from main import invoke, invoke_async, end_session, chat_with_agent, _run_turns 
 
-# Test successful invoke
-@patch('main.bedrock_agent_runtime')
-def test_invoke_success(mock_runtime):
-    mock_runtime.invoke_agent.return_value = {"completion": [{"chunk": {"bytes": b"Hello, world!"}}]}
-    result = invoke("Hello", "session123", "alias123", "agent123")
+# Test successful invoke writes one prefix, the raw chunk bytes and one newline
+@patch('main.get_client')
+def test_invoke_success(mock_get_client):
+    mock_runtime = mock_get_client.return_value
+    mock_runtime.invoke_agent.return_value = {"completion": [{"chunk": {"bytes": b"Hello, "}}, {"chunk": {"bytes": b"world!"}}]}
+    out = io.BytesIO()
+    result = invoke("Hello", "session123", "alias123", "agent123", out=out)
     assert result is True
+    assert out.getvalue() == b"JARVIS: Hello, world!\n"
     mock_runtime.invoke_agent.assert_called_once()
 
+# Test piped output is only flushed once, at the end of the turn
+@patch('main.get_client')
+def test_invoke_piped_flushes_once(mock_get_client):
+    mock_runtime = mock_get_client.return_value
+    mock_runtime.invoke_agent.return_value = {"completion": [{"chunk": {"bytes": b"x"}}] * 20}
+    out = io.BytesIO()
+    with patch.object(out, 'flush', wraps=out.flush) as mock_flush:
+        invoke("Hello", "session123", "alias123", "agent123", out=out)
+    assert out.getvalue() == b"JARVIS: " + b"x" * 20 + b"\n"
+    mock_flush.assert_called_once()
+
+# Test latency profile is forwarded to the agent
+@patch('main.get_client')
+def test_invoke_latency_optimized(mock_get_client):
+    mock_runtime = mock_get_client.return_value
+    mock_runtime.invoke_agent.return_value = {"completion": [{"chunk": {"bytes": b"Hello, world!"}}]}
+    invoke("Hello", "session123", "alias123", "agent123", latency="optimized")
+    params = mock_runtime.invoke_agent.call_args.kwargs
+    assert params["bedrockModelConfigurations"] == {"performanceConfig": {"latency": "optimized"}}
+
+# Test invoke stops reading the stream once cancelled
+@patch('main.get_client')
+def test_invoke_cancelled(mock_get_client):
+    mock_runtime = mock_get_client.return_value
+    mock_runtime.invoke_agent.return_value = {"completion": [{"chunk": {"bytes": b"Hello, world!"}}]}
+    cancel = threading.Event()
+    cancel.set()
+    out = io.BytesIO()
+    invoke("Hello", "session123", "alias123", "agent123", out=out, cancel=cancel)
+    assert out.getvalue() == b"JARVIS: \n"
+
 # Test invoke failure due to missing params
 def test_invoke_missing_params():
     result = invoke("", "session123", "alias123", "agent123")
     assert result is False
 
 # Test invoke API error
-@patch('main.bedrock_agent_runtime')
-def test_invoke_api_error(mock_runtime):
+@patch('main.get_client')
+def test_invoke_api_error(mock_get_client):
+    mock_runtime = mock_get_client.return_value
     mock_runtime.invoke_agent.side_effect = Exception("API Error")
     result = invoke("Hello", "session123", "alias123", "agent123")
     assert result is False
 
+# Test async invoke collects the streamed text
+@patch('main.get_client')
+def test_invoke_async_success(mock_get_client):
+    mock_runtime = mock_get_client.return_value
+    mock_runtime.invoke_agent.return_value = {"completion": [{"chunk": {"bytes": b"Hello, "}}, {"chunk": {"bytes": b"world!"}}]}
+    result = asyncio.run(invoke_async("Hello", "session123", "alias123", "agent123"))
+    assert result == "Hello, world!"
+    mock_runtime.invoke_agent.assert_called_once()
+
+# Test async invoke keeps working across event loops with more calls than the concurrency limit
+@patch('main.get_client')
+def test_invoke_async_repeated_runs(mock_get_client):
+    mock_runtime = mock_get_client.return_value
+    mock_runtime.invoke_agent.side_effect = lambda **kwargs: {"completion": [{"chunk": {"bytes": b"Hello, world!"}}]}
+
+    async def batch():
+        return await asyncio.gather(*[invoke_async("Hello", f"session{i}", "alias123", "agent123") for i in range(20)])
+
+    for _ in range(2):
+        assert asyncio.run(batch()) == ["Hello, world!"] * 20
+
+# Test concurrent first calls share a single client
+@patch('main._client', None)
+@patch('main.create_client')
+def test_invoke_async_creates_one_client(mock_create_client):
+    client = MagicMock()
+    client.invoke_agent.side_effect = lambda **kwargs: {"completion": [{"chunk": {"bytes": b"Hello, world!"}}]}
+    mock_create_client.side_effect = lambda: time.sleep(0.05) or client
+
+    async def batch():
+        return await asyncio.gather(*[invoke_async("Hello", f"session{i}", "alias123", "agent123") for i in range(8)])
+
+    assert asyncio.run(batch()) == ["Hello, world!"] * 8
+    mock_create_client.assert_called_once()
+
+# Test async invoke decodes characters split across chunks
+@patch('main.get_client')
+def test_invoke_async_split_character(mock_get_client):
+    mock_runtime = mock_get_client.return_value
+    encoded = "café".encode("utf-8")
+    mock_runtime.invoke_agent.return_value = {"completion": [{"chunk": {"bytes": encoded[:-1]}}, {"chunk": {"bytes": encoded[-1:]}}]}
+    result = asyncio.run(invoke_async("Hello", "session123", "alias123", "agent123"))
+    assert result == "café"
+
 # Test end session
 @patch('main.invoke', return_value=True)
 def test_end_session(mock_invoke):
     end_session("alias123", "session123", "agent123")
     mock_invoke.assert_called_once_with("Goodbye", "session123", "alias123", "agent123", memoryId=None, endSession=True)
+
+# Test REPL worker numbers turns in the session attributes
+@patch('main.invoke', return_value=True)
+def test_run_turns_session_state(mock_invoke):
+    turns = queue.Queue()
+    for item in ["Hello", "Again", None]:
+        turns.put(item)
+    seen = []
+    mock_invoke.side_effect = lambda *args, **kwargs: seen.append(dict(kwargs["session_state"]["sessionAttributes"])) or True
+    _run_turns(turns, "alias123", "session123", "agent123")
+    assert seen == [{"user": "local", "turn": "1"}, {"user": "local", "turn": "2"}]
+
+# Test REPL worker logs and stops instead of dying silently on SystemExit
+@patch('main.invoke', side_effect=SystemExit(1))
+def test_run_turns_system_exit(mock_invoke):
+    turns = queue.Queue()
+    turns.put("Hello")
+    _run_turns(turns, "alias123", "session123", "agent123")
+    mock_invoke.assert_called_once()
+
+# Test the REPL answers every queued question when input ends without 'exit'
+@patch('main.get_client')
+@patch('main.invoke', return_value=True)
+def test_chat_with_agent_eof(mock_invoke, mock_get_client):
+    with patch('builtins.input', side_effect=["Hello", "Second", EOFError]):
+        chat_with_agent("alias123", "session123", "agent123")
+    sent = [call.args[0] for call in mock_invoke.call_args_list]
+    assert sent == ["Hello", "Second", "Goodbye"]
+
+# Test a blank line while an answer is streaming doesn't print a second prompt
+@patch('main.get_client')
+def test_chat_with_agent_blank_line_while_streaming(mock_get_client):
+    prompts = []
+    answering = threading.Event()
+    release = threading.Event()
+
+    def slow_invoke(*args, **kwargs):
+        answering.set()
+        release.wait(5)
+        return True
+
+    def fake_input(prompt):
+        prompts.append(prompt)
+        if len(prompts) == 1:
+            return "Hello"
+        if len(prompts) == 2:
+            answering.wait(5)
+            return ""
+        release.set()
+        raise EOFError
+
+    with patch('main.invoke', side_effect=slow_invoke), patch('builtins.input', side_effect=fake_input), \
+            patch('builtins.print') as mock_print:
+        chat_with_agent("alias123", "session123", "agent123")
+    assert prompts == ["You: ", "", ""]
+    printed = [call.args[0] for call in mock_print.call_args_list if call.args]
+    assert not any("Please enter some text" in text for text in printed)